@@ -1,13 +1,71 @@
 """
 使用 PyInstaller 打包 OCR 模块为独立可执行文件
+
+这是唯一的打包入口（本地构建与 GitHub Actions 共用）。使用 --onedir：
+--onefile 每次启动都要把整个 torch 运行时解压到临时目录，冷启动慢得多。
+
+构建环境中若以 pillow-simd 替换 pillow（同为 PIL 包名），会被 --collect-all=PIL 一并打包，
+获得 SSE4/AVX2 加速的缩放与颜色空间转换。安装 PyTurboJPEG 后 JPEG 输入走 libjpeg-turbo 解码。
 """
 import PyInstaller.__main__
 import os
 import sys
+import json
+import pickle
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 ocr_script = os.path.join(script_dir, "ocr_server.py")
 
+# 预先序列化的 tokenizer / 图像处理器，放在 ocr_engine.exe 同级目录
+processor_dir = os.path.join('..', 'src-tauri', 'ocr_engine', 'ocr_engine', 'texify_processor')
+# CPU 推理用的 texify ONNX 模型，同样放在 ocr_engine.exe 同级目录
+onnx_dir = os.path.join('..', 'src-tauri', 'ocr_engine', 'ocr_engine', 'texify_onnx')
+
+
+def export_processor(output_dir):
+    """导出 texify 处理器：tokenizer 只保留 fast 格式的 tokenizer.json
+
+    运行时 ocr_server.py 直接用 tokenizers.Tokenizer.from_file 加载，
+    跳过 transformers AutoTokenizer 的解析流程。解码时的空格清理开关
+    与特殊 token id 一起写入 special_tokens.json，保证输出与原 tokenizer 一致。
+    """
+    from texify.model.processor import load_processor
+
+    processor = load_processor()
+    tokenizer = processor.tokenizer
+    os.makedirs(output_dir, exist_ok=True)
+
+    saved = tokenizer.save_pretrained(output_dir, legacy_format=False)
+    for path in saved:
+        if os.path.basename(path) != 'tokenizer.json':
+            os.remove(path)
+
+    with open(os.path.join(output_dir, 'special_tokens.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            'bos_token_id': tokenizer.bos_token_id,
+            'eos_token_id': tokenizer.eos_token_id,
+            'pad_token_id': tokenizer.pad_token_id,
+            'clean_up_tokenization_spaces': bool(tokenizer.clean_up_tokenization_spaces),
+        }, f)
+
+    # 图像处理器带有 texify 运行时修改过的属性，直接序列化整个对象
+    with open(os.path.join(output_dir, 'image_processor.pkl'), 'wb') as f:
+        pickle.dump(processor.image_processor, f)
+
+
+def export_onnx_models(output_dir):
+    """导出 texify ONNX 模型并生成 INT8 动态量化编码器
+
+    没有 CUDA 时 ocr_server.py 通过 ONNX Runtime 推理；INT8 编码器仅在支持
+    AVX-512 VNNI 的 CPU 上启用。静态量化需要校准图片，不在打包时进行。
+    """
+    from export_onnx import export_texify
+    from quantize_onnx import quantize_encoder_dynamic
+
+    export_texify(output_dir)
+    quantize_encoder_dynamic(output_dir)
+
+
 PyInstaller.__main__.run([
     ocr_script,
     '--onedir',
@@ -17,16 +75,56 @@ PyInstaller.__main__.run([
     '--specpath=../build',
     '--clean',
     '--noconfirm',
-    # 隐藏控制台窗口
-    '--noconsole',
+    # 保留控制台子系统：常驻模式依赖 stdin/stdout 管道通信，
+    # 窗口由 Rust 端以 CREATE_NO_WINDOW 启动时隐藏
     # 收集 texify 相关依赖
     '--collect-all=texify',
-    '--collect-all=transformers',
     '--collect-all=tokenizers',
-    '--collect-all=torch',
     '--collect-all=PIL',
+    # torch / transformers 不再 collect-all：只收集推理链路实际用到的子模块，
+    # 其余依赖交给 PyInstaller 的静态分析和 hooks-contrib 中的 torch hook（含 DLL）
+    '--collect-submodules=torch.nn',
+    '--collect-submodules=transformers.models.auto',
+    '--collect-submodules=transformers.models.vision_encoder_decoder',
+    '--collect-submodules=transformers.models.donut',
+    '--collect-submodules=transformers.models.mbart',
+    '--collect-submodules=transformers.generation',
+    # transformers 导入时会检查这些包的版本元数据
+    '--copy-metadata=transformers',
+    '--copy-metadata=tokenizers',
+    '--copy-metadata=huggingface-hub',
+    '--copy-metadata=safetensors',
+    '--copy-metadata=tqdm',
+    '--copy-metadata=regex',
+    '--copy-metadata=requests',
+    '--copy-metadata=packaging',
+    '--copy-metadata=filelock',
+    '--copy-metadata=numpy',
+    '--copy-metadata=pyyaml',
+    # 推理用不到、且不会在 import torch / transformers 时被导入的模块。
+    # 注意 torch.distributed、torch.testing 以及 transformers.models 下的其他模型族
+    # 会在包导入时被引用，不能排除；transformers.onnx 也不能排除：
+    # MBartConfig / VisionEncoderDecoderConfig 在模块顶层 `from ...onnx import OnnxConfig`
+    '--exclude-module=torch.onnx',
+    '--exclude-module=torch.utils.tensorboard',
+    '--exclude-module=torchvision',
+    '--exclude-module=transformers.pipelines',
+    '--exclude-module=transformers.trainer',
+    '--exclude-module=transformers.commands',
+    '--exclude-module=transformers.benchmark',
+    '--exclude-module=tensorflow',
+    '--exclude-module=flax',
+    '--exclude-module=jax',
+    '--collect-all=onnxruntime',
+    '--hidden-import=cpuinfo',
+    '--hidden-import=psutil',
+    '--hidden-import=turbojpeg',
+    '--hidden-import=cv2',
     '--hidden-import=texify',
     '--hidden-import=texify.inference',
     '--hidden-import=texify.model.model',
     '--hidden-import=texify.model.processor',
 ])
+
+export_processor(processor_dir)
+export_onnx_models(onnx_dir)
@@ -1,9 +1,12 @@
 """
 将 pix2tex (LaTeX-OCR) 模型导出为 ONNX 格式。
 首次运行会自动下载模型权重（约 200MB）。
+
+使用 `--texify` 参数时改为导出 texify 模型（编码器 + 自回归解码器）到 models/texify/。
 """
 import os
 import sys
+import inspect
 import torch
 import torch.nn as nn
 
@@ -88,5 +91,179 @@ def main():
     except Exception as e:
         print(f"ONNX 验证警告: {e}")
 
+TEXIFY_OUTPUT_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "models", "texify")
+)
+# 新版 torch 默认使用 dynamo 导出器，它不接受 dynamic_axes；固定使用 TorchScript 导出器。
+# torch 2.5 之前没有该参数，本身就是 TorchScript 导出
+TORCHSCRIPT_EXPORT = (
+    {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+)
+
+
+class TexifyEncoder(nn.Module):
+    """texify 编码器：pixel_values -> encoder_hidden_states（含可选的投影层）"""
+
+    def __init__(self, model):
+        super().__init__()
+        self.encoder = model.encoder
+        self.enc_to_dec_proj = getattr(model, "enc_to_dec_proj", None)
+
+    def forward(self, pixel_values):
+        hidden = self.encoder(pixel_values=pixel_values, return_dict=True).last_hidden_state
+        if self.enc_to_dec_proj is not None:
+            hidden = self.enc_to_dec_proj(hidden)
+        return hidden
+
+
+class TexifyDecoderInit(nn.Module):
+    """解码首步：无 past，输出 logits 以及每层 self/cross 注意力的 KV"""
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, input_ids, encoder_hidden_states):
+        out = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            use_cache=True,
+            return_dict=True,
+        )
+        presents = [t for layer in out.past_key_values for t in layer]
+        return (out.logits, *presents)
+
+
+class TexifyDecoderWithPast(nn.Module):
+    """解码后续步：输入上一步的 KV，输出 logits 与更新后的 self 注意力 KV
+
+    cross 注意力 KV 只依赖编码器输出，首步算出后保持不变，因此不再输出。
+    不接收 encoder_hidden_states：cross KV 来自 past 时，MBart 只读取它的序列长度
+    （且 tracing 会把该比较固化为常量），作为图输入会被导出器裁掉。这里用 cross key
+    构造一个序列长度相同的占位张量，仅用于让解码层走 cross 注意力分支。
+    """
+
+    def __init__(self, decoder):
+        super().__init__()
+        self.decoder = decoder
+
+    def forward(self, input_ids, *past):
+        past_key_values = tuple(tuple(past[i:i + 4]) for i in range(0, len(past), 4))
+        # cross key 形状为 (batch, heads, encoder_seq_len, head_dim)
+        encoder_hidden_states = past[2][:, 0]
+        out = self.decoder(
+            input_ids=input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=True,
+        )
+        presents = [t for layer in out.past_key_values for t in layer[:2]]
+        return (out.logits, *presents)
+
+
+def texify_kv_names(prefix, num_layers, with_cross=True):
+    """按层展开的 KV 张量名，如 past.0.key / past.0.cross_value"""
+    kinds = ["key", "value", "cross_key", "cross_value"] if with_cross else ["key", "value"]
+    return [f"{prefix}.{i}.{kind}" for i in range(num_layers) for kind in kinds]
+
+
+def export_texify(output_dir=TEXIFY_OUTPUT_DIR, opset_version=17):
+    """将 texify 导出为 encoder.onnx / decoder.onnx / decoder_with_past.onnx 三个图"""
+    from texify.model.model import load_model
+    from texify.model.processor import load_processor
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    print("正在加载 texify 模型...")
+    # load_model 默认放到 CUDA/MPS 并使用 FP16，而处理器输出在 CPU 上：固定在 CPU 上以 FP32 导出
+    model = load_model(device="cpu", dtype=torch.float32).eval()
+    processor = load_processor()
+    num_layers = model.decoder.config.decoder_layers
+
+    # 用处理器生成示例输入，保证尺寸与推理时一致
+    from PIL import Image
+    dummy = Image.new("RGB", (672, 64), "white")
+    pixel_values = processor(images=[dummy], return_tensors="pt")["pixel_values"].float()
+    input_ids = torch.tensor([[processor.tokenizer.bos_token_id]], dtype=torch.long)
+
+    encoder = TexifyEncoder(model).eval()
+    decoder_init = TexifyDecoderInit(model.decoder).eval()
+    decoder_with_past = TexifyDecoderWithPast(model.decoder).eval()
+
+    with torch.no_grad():
+        encoder_hidden_states = encoder(pixel_values)
+        init_outputs = decoder_init(input_ids, encoder_hidden_states)
+    past = list(init_outputs[1:])
+
+    encoder_path = os.path.join(output_dir, "encoder.onnx")
+    print(f"正在导出编码器到: {encoder_path}")
+    torch.onnx.export(
+        encoder,
+        (pixel_values,),
+        encoder_path,
+        input_names=["pixel_values"],
+        output_names=["encoder_hidden_states"],
+        dynamic_axes={
+            "pixel_values": {0: "batch", 2: "height", 3: "width"},
+            "encoder_hidden_states": {0: "batch", 1: "encoder_seq_len"},
+        },
+        opset_version=opset_version,
+        do_constant_folding=True,
+        **TORCHSCRIPT_EXPORT,
+    )
+
+    present_names = texify_kv_names("present", num_layers)
+    decoder_path = os.path.join(output_dir, "decoder.onnx")
+    print(f"正在导出解码器（首步）到: {decoder_path}")
+    torch.onnx.export(
+        decoder_init,
+        (input_ids, encoder_hidden_states),
+        decoder_path,
+        input_names=["input_ids", "encoder_hidden_states"],
+        output_names=["logits", *present_names],
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "encoder_hidden_states": {0: "batch", 1: "encoder_seq_len"},
+            "logits": {0: "batch"},
+            **{name: {0: "batch"} for name in present_names},
+        },
+        opset_version=opset_version,
+        do_constant_folding=True,
+        **TORCHSCRIPT_EXPORT,
+    )
+
+    past_names = texify_kv_names("past", num_layers)
+    self_present_names = texify_kv_names("present", num_layers, with_cross=False)
+    past_axes = {
+        name: {0: "batch", 2: "encoder_seq_len" if ".cross_" in name else "past_seq_len"}
+        for name in past_names
+    }
+    decoder_with_past_path = os.path.join(output_dir, "decoder_with_past.onnx")
+    print(f"正在导出解码器（带 KV 缓存）到: {decoder_with_past_path}")
+    torch.onnx.export(
+        decoder_with_past,
+        (input_ids, *past),
+        decoder_with_past_path,
+        input_names=["input_ids", *past_names],
+        output_names=["logits", *self_present_names],
+        dynamic_axes={
+            "input_ids": {0: "batch"},
+            "logits": {0: "batch"},
+            **past_axes,
+            **{name: {0: "batch", 2: "total_seq_len"} for name in self_present_names},
+        },
+        opset_version=opset_version,
+        do_constant_folding=True,
+        **TORCHSCRIPT_EXPORT,
+    )
+
+    for path in (encoder_path, decoder_path, decoder_with_past_path):
+        print(f"导出成功: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+
+
 if __name__ == "__main__":
-    main()
+    if "--texify" in sys.argv:
+        export_texify()
+    else:
+        main()
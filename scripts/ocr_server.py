@@ -1,10 +1,19 @@
 """
 Texify OCR 服务脚本
 使用 texify 模型识别数学公式，输出 LaTeX（JSON 格式）
+
+用法:
+    ocr_engine <image_path>   单次识别，输出一行 JSON 后退出
+    ocr_engine --serve        常驻模式：模型只加载一次，从 stdin 逐行读取请求，
+                              每个请求输出一行 JSON。请求可以是单个图片路径，
+                              也可以是批量请求 {"paths": [...]}
 """
 import sys
 import json
 import os
+import argparse
+import tempfile
+import traceback
 import warnings
 import logging
 
@@ -21,64 +30,858 @@ os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 warnings.filterwarnings("ignore")
 logging.disable(logging.CRITICAL)
 
+# 调试模式：错误响应中附带完整堆栈（OCR_DEBUG=1 或 --debug）
+DEBUG = os.environ.get("OCR_DEBUG") == "1"
+
+# 模型与处理器缓存（常驻模式下只加载一次）
+_model = None
+_processor = None
+_onnx_sessions = None
+
+# texify ONNX 模型目录：打包版本由 build_ocr.py 导出到 exe 同级的 texify_onnx/，
+# 开发时使用 export_onnx.py --texify 生成的 models/texify/
+ONNX_MODEL_DIR = os.environ.get("TEXIFY_ONNX_DIR") or (
+    os.path.join(os.path.dirname(sys.executable), "texify_onnx")
+    if getattr(sys, "frozen", False)
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "models", "texify")
+)
+# 构建时导出的 tokenizer.json 等处理器文件（见 build_ocr.py）
+PROCESSOR_CACHE_DIR = os.environ.get("TEXIFY_PROCESSOR_DIR") or os.path.join(
+    os.path.dirname(sys.executable if getattr(sys, "frozen", False) else os.path.abspath(__file__)),
+    "texify_processor",
+)
+
+# 共享内存权重缓存（由开发用的 ocr_warmup.py 创建，应用打包版本不使用）
+SHM_LAYOUT_PATH = os.path.join(tempfile.gettempdir(), "formulasnap_texify_weights.json")
+_shared_weights = None
+
+ONNX_MODEL_FILES = ("encoder.onnx", "decoder.onnx", "decoder_with_past.onnx")
+# INT8 量化编码器（由 quantize_onnx.py 生成，静态量化优先），仅在支持 AVX-512 VNNI 的 CPU 上启用
+ONNX_INT8_ENCODER_FILES = ("encoder.int8_static.onnx", "encoder.int8.onnx")
+
+
 def output_json(data):
-    """输出 JSON 到原始 stdout"""
-    print(json.dumps(data), file=_original_stdout)
+    """输出一行 JSON 到原始 stdout 并立即刷新，避免管道下的块缓冲"""
+    line = json.dumps(data) + "\n"
+    _original_stdout.buffer.write(line.encode("utf-8"))
+    _original_stdout.flush()
 
-def main():
-    if len(sys.argv) < 2:
-        output_json({"error": "用法: ocr_engine <image_path>"})
-        sys.exit(1)
 
-    image_path = sys.argv[1]
-    
-    if not os.path.exists(image_path):
-        output_json({"error": f"图片文件不存在: {image_path}"})
-        sys.exit(1)
+class FastTokenizer:
+    """tokenizers.Tokenizer 的轻量包装，只提供 texify 推理用到的接口"""
+
+    def __init__(self, tokenizer_path, special_tokens):
+        from tokenizers import Tokenizer
+
+        self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.bos_token_id = special_tokens["bos_token_id"]
+        self.eos_token_id = special_tokens["eos_token_id"]
+        self.pad_token_id = special_tokens["pad_token_id"]
+        self.clean_up_tokenization_spaces = special_tokens.get("clean_up_tokenization_spaces", False)
+
+    @staticmethod
+    def clean_up_tokenization(text):
+        """与 transformers PreTrainedTokenizerBase.clean_up_tokenization 相同的空格清理"""
+        return (
+            text.replace(" .", ".")
+            .replace(" ?", "?")
+            .replace(" !", "!")
+            .replace(" ,", ",")
+            .replace(" ' ", "'")
+            .replace(" n't", "n't")
+            .replace(" 'm", "'m")
+            .replace(" 's", "'s")
+            .replace(" 've", "'ve")
+            .replace(" 're", "'re")
+        )
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        if hasattr(token_ids, "tolist"):
+            token_ids = token_ids.tolist()
+        text = self._tokenizer.decode(token_ids, skip_special_tokens=skip_special_tokens)
+        if self.clean_up_tokenization_spaces:
+            text = self.clean_up_tokenization(text)
+        return text
+
+    def batch_decode(self, sequences, skip_special_tokens=False):
+        sequences = [seq.tolist() if hasattr(seq, "tolist") else list(seq) for seq in sequences]
+        texts = self._tokenizer.decode_batch(sequences, skip_special_tokens=skip_special_tokens)
+        if self.clean_up_tokenization_spaces:
+            texts = [self.clean_up_tokenization(text) for text in texts]
+        return texts
+
+
+class FastProcessor:
+    """替代 texify 的 VariableDonutProcessor：图像预处理 + FastTokenizer"""
+
+    def __init__(self, image_processor, tokenizer):
+        self.image_processor = image_processor
+        self.tokenizer = tokenizer
+
+    def __call__(self, images=None, **kwargs):
+        # 只做图像预处理，文本相关参数（如 add_special_tokens）对图像处理器无意义
+        kwargs.pop("add_special_tokens", None)
+        return self.image_processor(images, **kwargs)
+
+
+def _load_cached_processor():
+    """从构建时导出的文件加载处理器；文件不全时返回 None"""
+    tokenizer_path = os.path.join(PROCESSOR_CACHE_DIR, "tokenizer.json")
+    special_path = os.path.join(PROCESSOR_CACHE_DIR, "special_tokens.json")
+    image_processor_path = os.path.join(PROCESSOR_CACHE_DIR, "image_processor.pkl")
+    if not all(os.path.exists(p) for p in (tokenizer_path, special_path, image_processor_path)):
+        return None
+
+    import pickle
+
+    with open(special_path, "r", encoding="utf-8") as f:
+        special_tokens = json.load(f)
+    # 该文件由 build_ocr.py 生成并随应用一起分发；
+    # 反序列化仍会导入 texify.model.processor（图像处理器类定义在其中）
+    with open(image_processor_path, "rb") as f:
+        image_processor = pickle.load(f)
+    return FastProcessor(image_processor, FastTokenizer(tokenizer_path, special_tokens))
+
+
+def error_response(e, prefix=""):
+    """构造错误响应；格式化堆栈开销较大，仅在调试模式下附带"""
+    response = {"error": f"{prefix}{e}"}
+    if DEBUG:
+        response["traceback"] = traceback.format_exc()
+    return response
+
+
+def get_processor():
+    """懒加载 texify 处理器（图像预处理 + tokenizer）"""
+    global _processor
+    if _processor is None:
+        # 缓存路径不构建 AutoTokenizer，日志级别已由 TRANSFORMERS_VERBOSITY 控制
+        _processor = _load_cached_processor()
+        if _processor is None:
+            import transformers
+            from texify.model.processor import load_processor
+
+            transformers.logging.set_verbosity_error()
+
+            _processor = load_processor()
+    return _processor
+
+
+def _attach_shared_weights():
+    """若 ocr_warmup.py 已把权重放入共享内存，返回直接指向该内存的 state_dict"""
+    global _shared_weights
+    if not os.path.exists(SHM_LAYOUT_PATH):
+        return None
+
+    import torch
+    from multiprocessing import shared_memory
+    from texify.settings import settings
 
     try:
-        import transformers
-        transformers.logging.set_verbosity_error()
-        
-        from texify.inference import batch_inference
+        with open(SHM_LAYOUT_PATH, "r", encoding="utf-8") as f:
+            layout = json.load(f)
+        if layout.get("checkpoint") != settings.MODEL_CHECKPOINT:
+            return None
+        shm = shared_memory.SharedMemory(name=layout["name"])
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if os.name != "nt":
+        # 只是附加到预热进程的内存块，退出时不能让 resource_tracker 把它删掉
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+
+    state_dict = {}
+    for name, entry in layout["tensors"].items():
+        dtype = getattr(torch, entry["dtype"])
+        tensor = torch.frombuffer(shm.buf, dtype=dtype, count=entry["numel"], offset=entry["offset"])
+        state_dict[name] = tensor.view(entry["shape"])
+
+    # 张量只是 shm.buf 的视图，必须保持 shm 存活
+    _shared_weights = shm
+    return state_dict
+
+
+def _patch_weight_loading(state_dict):
+    """让 transformers 从共享内存取权重，跳过磁盘读取与 safetensors 解析"""
+    import transformers.modeling_utils as modeling_utils
+
+    modeling_utils.load_state_dict = lambda *args, **kwargs: dict(state_dict)
+
+
+def _configure_torch_threads():
+    """intra-op 线程数设为物理核心数，关闭 inter-op 并行，避免嵌套并行导致的线程争用"""
+    import torch
+
+    torch.set_num_threads(_physical_cores())
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # 已有并行任务运行过时不能再修改
+        pass
+
+
+def _use_channels_last(model):
+    """编码器切换为 channels_last，使 oneDNN 选用 NHWC 卷积核
+
+    权重只重排一次；batch_inference 内部构造的 pixel_values 通过 pre-hook 转换。
+    """
+    import torch
+
+    def to_channels_last(module, args, kwargs):
+        pixel_values = kwargs.get("pixel_values")
+        if pixel_values is not None:
+            kwargs["pixel_values"] = pixel_values.contiguous(memory_format=torch.channels_last)
+        return args, kwargs
+
+    model.encoder = model.encoder.to(memory_format=torch.channels_last)
+    model.encoder.register_forward_pre_hook(to_channels_last, with_kwargs=True)
+
+
+def _write_kv(module, key, value, past_key_value):
+    """把本步的 K/V 写入预分配缓冲区，返回截至当前位置的视图
+
+    缓冲区形状为 (2, batch, heads, max_len, head_dim)，首步分配（形状兼容时跨请求复用）。
+    后续步骤传回的 past 就是上一步返回的视图，只需从其长度处继续写入。
+    past 不是本缓冲区的视图或容量不足时，退回原来的 torch.cat。
+    """
+    import torch
+
+    cursor = 0 if past_key_value is None else past_key_value[0].shape[2]
+    end = cursor + key.shape[2]
+    buffer = getattr(module, "_kv_buffer", None)
+
+    if cursor == 0:
+        if (
+            buffer is None
+            or buffer.shape[1:3] != key.shape[:2]
+            or buffer.shape[4] != key.shape[3]
+            or buffer.shape[3] < end
+            or buffer.dtype != key.dtype
+            or buffer.device != key.device
+        ):
+            bsz, heads, _, head_dim = key.shape
+            buffer = key.new_empty((2, bsz, heads, max(module._kv_max_len, end), head_dim))
+            module._kv_buffer = buffer
+    elif (
+        buffer is None
+        or end > buffer.shape[3]
+        or past_key_value[0].data_ptr() != buffer[0].data_ptr()
+    ):
+        return (
+            torch.cat([past_key_value[0], key], dim=2),
+            torch.cat([past_key_value[1], value], dim=2),
+        )
+
+    buffer[0, :, :, cursor:end] = key
+    buffer[1, :, :, cursor:end] = value
+    return buffer[0, :, :, :end], buffer[1, :, :, :end]
+
+
+def _preallocated_self_attention(module, hidden_states, key_value_states=None, past_key_value=None,
+                                 attention_mask=None, layer_head_mask=None, output_attentions=False, **kwargs):
+    """MBart 解码器 self-attention 的替代 forward：KV 写入预分配缓冲区
+
+    与原实现等价（推理模式，无 dropout），只是不再每步 torch.cat 重新分配 KV。
+    cross-attention、head mask 或需要输出注意力权重时交回原 forward。
+    """
+    import torch.nn.functional as F
+
+    if key_value_states is not None or layer_head_mask is not None or output_attentions:
+        return module._original_forward(
+            hidden_states, key_value_states=key_value_states, past_key_value=past_key_value,
+            attention_mask=attention_mask, layer_head_mask=layer_head_mask,
+            output_attentions=output_attentions, **kwargs,
+        )
+
+    bsz, tgt_len, _ = hidden_states.size()
+
+    def heads(states):
+        return states.view(bsz, tgt_len, module.num_heads, module.head_dim).transpose(1, 2)
+
+    query = heads(module.q_proj(hidden_states))
+    key, value = _write_kv(
+        module, heads(module.k_proj(hidden_states)), heads(module.v_proj(hidden_states)), past_key_value
+    )
+
+    attn_output = F.scaled_dot_product_attention(
+        query, key, value,
+        attn_mask=attention_mask,
+        is_causal=attention_mask is None and tgt_len > 1,
+    )
+    attn_output = attn_output.transpose(1, 2).reshape(bsz, tgt_len, module.embed_dim)
+    return module.out_proj(attn_output), None, (key, value)
+
+
+def _preallocate_kv_cache(model, max_len):
+    """为解码器每层 self-attention 换上预分配 KV 缓存的 forward
+
+    只替换实例的 forward，不改变模块结构和 state_dict 键名。
+    """
+    import types
+
+    for name, module in model.decoder.named_modules():
+        if not name.endswith("self_attn") or not all(
+            hasattr(module, attr) for attr in ("q_proj", "k_proj", "v_proj", "out_proj")
+        ):
+            continue
+        module._kv_max_len = max_len
+        module._original_forward = module.forward
+        module.forward = types.MethodType(_preallocated_self_attention, module)
+
+
+def _restore_self_attention(model):
+    """撤销 _preallocate_kv_cache，恢复原 forward 并释放缓冲区
+
+    编译后的解码器不能使用预分配缓存：data_ptr() 检查和缓冲区原地写入会在每层每步造成 graph break。
+    """
+    for module in model.decoder.modules():
+        original = module.__dict__.pop("_original_forward", None)
+        if original is not None:
+            del module.forward
+            module.__dict__.pop("_kv_buffer", None)
+            module.__dict__.pop("_kv_max_len", None)
+
+
+def get_model_and_processor():
+    """懒加载 texify 模型和处理器，后续调用直接复用缓存"""
+    global _model
+    processor = get_processor()
+    if _model is None:
         from texify.model.model import load_model
-        from texify.model.processor import load_processor
-        from PIL import Image
 
-        model = load_model()
-        processor = load_processor()
+        _configure_torch_threads()
+        state_dict = _attach_shared_weights()
+        if state_dict is not None:
+            _patch_weight_loading(state_dict)
+        _model = load_model()
+        _use_channels_last(_model)
+        # 公式 OCR 上 beam search 收益很小、开销随 beam 数线性增长：固定贪心解码 + KV 缓存
+        _model.generation_config.do_sample = False
+        _model.generation_config.num_beams = 1
+        _model.generation_config.use_cache = True
+
+        from texify.settings import settings
+        # 最长序列：起始 token + 生成上限
+        # 有 CUDA 时 load_model 已把模型放到 GPU 并转为 FP16
+        _preallocate_kv_cache(_model, settings.MAX_TOKENS + 1)
+    return _model, processor
+
+
+def _inference_context():
+    """推理上下文：关闭 autograd；GPU 上额外启用 FP16 autocast"""
+    import contextlib
+    import torch
+
+    stack = contextlib.ExitStack()
+    stack.enter_context(torch.inference_mode())
+    if torch.cuda.is_available():
+        stack.enter_context(torch.autocast("cuda", dtype=torch.float16))
+    return stack
+
+
+def _warmup(model, processor, max_tokens=1):
+    """用一张空白图片预热，使 CUDA 上下文初始化和 cuDNN 算法选择不落在首次识别上"""
+    from PIL import Image
+    from texify.inference import batch_inference
+
+    dummy = Image.new("RGB", (672, 64), "white")
+    with _inference_context():
+        batch_inference([dummy], model, processor, max_tokens=max_tokens)
+
+
+_eager_decoder = None
+
+
+def compile_decoder(model, processor):
+    """编译自回归解码器，去掉逐 token 的 Python 调度开销
+
+    仅在 GPU 上进行：冻结环境中编译多半失败，失败前的 inductor 导入和预热会全部落在首次识别上。
+    generate() 的 KV 缓存逐 token 增长，因此按动态形状编译，所有长度共用一份图；
+    不使用 reduce-overhead，否则每个不同的 past 长度都会在用户请求中录制一次 CUDA graph。
+    优先 torch.compile；不可用时退回 torch.jit.script，再失败则保持 eager。
+    编译在预热中触发，失败不影响识别。
+    """
+    global _eager_decoder
+    import torch
+
+    if not torch.cuda.is_available():
+        return
+
+    # 预分配 KV 缓存只用于 eager 解码器，编译前先撤销
+    _restore_self_attention(model)
+    eager = model.decoder
+    try:
+        model.decoder = torch.compile(eager, dynamic=True)
+        # 首步（无 past）和后续步（带 past）各触发一次编译
+        _warmup(model, processor, max_tokens=8)
+        _eager_decoder = eager
+        return
+    except Exception:
+        model.decoder = eager
+
+    try:
+        model.decoder = torch.jit.script(eager)
+        _warmup(model, processor, max_tokens=8)
+        _eager_decoder = eager
+        return
+    except Exception:
+        model.decoder = eager
+
+    # 编译均失败，仍以 eager 运行，恢复预分配 KV 缓存
+    from texify.settings import settings
+    _preallocate_kv_cache(model, settings.MAX_TOKENS + 1)
+
+
+def _use_eager_decoder(model):
+    """换回 eager 解码器并恢复预分配 KV 缓存；解码器未编译时返回 False"""
+    global _eager_decoder
+    if _eager_decoder is None:
+        return False
+
+    from texify.settings import settings
+
+    model.decoder = _eager_decoder
+    _eager_decoder = None
+    _preallocate_kv_cache(model, settings.MAX_TOKENS + 1)
+    return True
+
 
-        image = Image.open(image_path)
-        if image.mode != "RGB":
+def _physical_cores():
+    """物理核心数，用于 ONNX Runtime 的 intra-op 线程数"""
+    try:
+        import psutil
+        cores = psutil.cpu_count(logical=False)
+    except ImportError:
+        cores = None
+    return cores or os.cpu_count() or 1
+
+
+_vnni_supported = None
+
+
+def _cpu_has_vnni():
+    """CPU 是否支持 AVX-512 VNNI；不支持时 INT8 MatMul 反而比 FP32 慢
+
+    py-cpuinfo 默认在 multiprocessing 子进程中执行 CPUID，打包后的 exe 会被重新拉起一次，
+    这里改为在当前进程内检测，并缓存结果。
+    """
+    global _vnni_supported
+    if _vnni_supported is None:
+        try:
+            import cpuinfo
+            cpuinfo.CAN_CALL_CPUID_IN_SUBPROCESS = False
+            flags = cpuinfo.get_cpu_info().get("flags", [])
+        except Exception:
+            flags = []
+        _vnni_supported = "avx512_vnni" in flags or "avx512vnni" in flags
+    return _vnni_supported
+
+
+def _encoder_model_path():
+    """优先选用 INT8 编码器（需 CPU 支持 VNNI），否则使用 FP32 编码器"""
+    int8_paths = [os.path.join(ONNX_MODEL_DIR, name) for name in ONNX_INT8_ENCODER_FILES]
+    int8_paths = [path for path in int8_paths if os.path.exists(path)]
+    # 没有 INT8 模型时无需检测 CPU
+    if int8_paths and _cpu_has_vnni():
+        return int8_paths[0]
+    return os.path.join(ONNX_MODEL_DIR, "encoder.onnx")
+
+
+def _create_session(ort, path, options):
+    """创建会话；同目录存在 ORT 格式模型（.ort）时优先加载它，跳过 protobuf 解析
+
+    按路径加载：Python 绑定会把传入的 bytes 复制到临时缓冲区，
+    配合 use_ort_model_bytes_* 选项时会话引用的内存随即失效，输出错误。
+    """
+    ort_path = os.path.splitext(path)[0] + ".ort"
+    if os.path.exists(ort_path):
+        path = ort_path
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def get_onnx_sessions():
+    """懒加载 texify 的 ONNX Runtime 会话；模型文件不全或有 CUDA 时返回 None
+
+    ONNX 模型只走 CPUExecutionProvider，有 GPU 时 PyTorch FP16 路径更快。
+    """
+    global _onnx_sessions
+    if _onnx_sessions is None:
+        paths = [os.path.join(ONNX_MODEL_DIR, name) for name in ONNX_MODEL_FILES]
+        if not all(os.path.exists(path) for path in paths):
+            return None
+
+        import torch
+        if torch.cuda.is_available():
+            return None
+        paths[0] = _encoder_model_path()
+
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = _physical_cores()
+        options.enable_mem_pattern = True
+        options.enable_cpu_mem_arena = True
+
+        encoder, decoder, decoder_with_past = (
+            _create_session(ort, path, options) for path in paths
+        )
+        _onnx_sessions = {
+            "encoder": encoder,
+            "decoder": decoder,
+            "decoder_with_past": decoder_with_past,
+        }
+    return _onnx_sessions
+
+
+def _run_with_binding(session, feeds):
+    """用 IOBinding 运行会话，输入输出都保持为 OrtValue，避免 KV 缓存来回拷贝"""
+    binding = session.io_binding()
+    for name, value in feeds.items():
+        binding.bind_ortvalue_input(name, value)
+    output_names = [o.name for o in session.get_outputs()]
+    for name in output_names:
+        binding.bind_output(name, "cpu")
+    session.run_with_iobinding(binding)
+    return dict(zip(output_names, binding.get_outputs()))
+
+
+def _run_encoder(sessions, pixel_values):
+    """用 IOBinding 运行编码器，输出保持为 OrtValue 直接交给解码器
+
+    CPU 上 ortvalue_from_numpy 不复制数据，预处理结果本身就是 ORT 读取的输入内存
+    （处理器输出已是连续的 float32，ascontiguousarray 不会再复制）。
+    """
+    import numpy as np
+    from onnxruntime import OrtValue
+
+    pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+    return _run_with_binding(sessions["encoder"], {
+        "pixel_values": OrtValue.ortvalue_from_numpy(pixel_values),
+    })["encoder_hidden_states"]
+
+
+def onnx_generate(pixel_values, sessions, bos_token_id, eos_token_id, max_tokens):
+    """ONNX Runtime 贪心解码：编码器运行一次，解码器逐 token 复用 KV 缓存"""
+    import numpy as np
+    from onnxruntime import OrtValue
+
+    def ids_value(token_id):
+        return OrtValue.ortvalue_from_numpy(np.array([[token_id]], dtype=np.int64))
+
+    encoder_hidden_states = _run_encoder(sessions, pixel_values)
+
+    outputs = _run_with_binding(sessions["decoder"], {
+        "input_ids": ids_value(bos_token_id),
+        "encoder_hidden_states": encoder_hidden_states,
+    })
+    # cross 注意力 KV 只在首步计算，之后每步原样传入
+    cross = {
+        name.replace("present.", "past.", 1): value
+        for name, value in outputs.items() if ".cross_" in name
+    }
+
+    token_ids = []
+    for _ in range(max_tokens):
+        next_id = int(outputs["logits"].numpy()[0, -1].argmax())
+        if next_id == eos_token_id:
+            break
+        token_ids.append(next_id)
+
+        feeds = {"input_ids": ids_value(next_id), **cross}
+        for name, value in outputs.items():
+            if name.startswith("present.") and ".cross_" not in name:
+                feeds[name.replace("present.", "past.", 1)] = value
+        outputs = _run_with_binding(sessions["decoder_with_past"], feeds)
+    return token_ids
+
+
+def onnx_inference(images, sessions, processor, token_budgets):
+    """与 texify.inference.batch_inference 等价的 ONNX Runtime 推理路径"""
+    from texify.output import postprocess
+
+    tokenizer = processor.tokenizer
+    results = []
+    for image, max_tokens in zip(images, token_budgets):
+        if getattr(image, "mode", "RGB") != "RGB":
             image = image.convert("RGB")
-        
-        results = batch_inference([image], model, processor)
-        
-        if results and len(results) > 0:
-            result = results[0]
-            if isinstance(result, str):
-                latex = result
-            elif hasattr(result, 'text'):
-                latex = result.text
-            elif isinstance(result, dict):
-                latex = result.get('text', result.get('latex', str(result)))
-            else:
-                latex = str(result)
-            
-            latex = latex.strip()
-            if latex.startswith("$$") and latex.endswith("$$"):
-                latex = latex[2:-2].strip()
-            elif latex.startswith("$") and latex.endswith("$"):
-                latex = latex[1:-1].strip()
-            
-            output_json({"latex": latex, "confidence": 0.95})
+        pixel_values = processor(images=[image], return_tensors="np")["pixel_values"]
+        token_ids = onnx_generate(
+            pixel_values,
+            sessions,
+            tokenizer.bos_token_id,
+            tokenizer.eos_token_id,
+            max_tokens,
+        )
+        results.append(postprocess(tokenizer.decode(token_ids, skip_special_tokens=True)))
+    return results
+
+
+def strip_math_delimiters(latex):
+    """去掉首尾的 $ / $$ 数学定界符"""
+    latex = latex.strip()
+    if latex.startswith("$$") and latex.endswith("$$"):
+        latex = latex[2:-2].strip()
+    elif latex.startswith("$") and latex.endswith("$"):
+        latex = latex[1:-1].strip()
+    return latex
+
+
+JPEG_EXTENSIONS = (".jpg", ".jpeg")
+# 单次 batch_inference 的最大图片数
+MAX_BATCH_SIZE = 8
+# 生成长度上限按截图面积估算：每行每 4 像素宽约一个 token，行数按行高估算；
+# 下限留足余量，避免窄而密的公式被截断
+PIXELS_PER_TOKEN = 4
+LINE_HEIGHT = 32
+MIN_NEW_TOKENS = 128
+_turbojpeg = None
+
+
+def load_image(image_path):
+    """读取图片
+
+    JPEG 在装有 PyTurboJPEG 时直接解码为 RGB numpy 数组（libjpeg-turbo SIMD 解码）；
+    其余格式用 PIL 打开，不做颜色转换——需要时由推理路径统一转换一次。
+    """
+    global _turbojpeg
+    if image_path.lower().endswith(JPEG_EXTENSIONS):
+        try:
+            from turbojpeg import TurboJPEG, TJPF_RGB
+
+            if _turbojpeg is None:
+                _turbojpeg = TurboJPEG()
+            with open(image_path, "rb") as f:
+                return _turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+        except (ImportError, OSError, RuntimeError):
+            # 未安装 PyTurboJPEG / 找不到 libturbojpeg 时回退到 PIL
+            pass
+
+    from PIL import Image
+
+    image = Image.open(image_path)
+    image.load()
+    return image
+
+
+def _result_text(result):
+    """兼容 texify 不同版本的返回类型（str / 带 text 属性的对象 / dict）"""
+    if isinstance(result, str):
+        return result
+    if hasattr(result, 'text'):
+        return result.text
+    if isinstance(result, dict):
+        return result.get('text', result.get('latex', str(result)))
+    return str(result)
+
+
+def _input_size(processor):
+    """texify 图像处理器的目标尺寸 (height, width)，兼容 dict 与 [h, w] 两种写法"""
+    size = processor.image_processor.size
+    if isinstance(size, dict):
+        return size["height"], size["width"]
+    return size[0], size[1]
+
+
+def downscale_image(image, max_height, max_width):
+    """大图先用 OpenCV INTER_AREA 缩小到模型输入尺寸以内
+
+    texify 处理器内部用 PIL 缩放，对整屏截图很慢；预先用 SIMD 优化的 INTER_AREA
+    缩小后，处理器只需处理小图。未安装 OpenCV 或图片本身不大时原样返回。
+    """
+    import numpy as np
+
+    try:
+        import cv2
+    except ImportError:
+        return image
+
+    if isinstance(image, np.ndarray):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+
+    scale = min(max_height / height, max_width / width)
+    if scale >= 1:
+        return image
+
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image.convert("RGB"))
+    target = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(image, target, interpolation=cv2.INTER_AREA)
+
+
+def token_budget(image):
+    """按截图面积估算生成 token 上限
+
+    LaTeX 长度大致与公式像素面积成正比：宽度决定每行长度，高度决定行数
+    （多行 aligned/cases、矩阵在像素上窄但 token 多）。
+    """
+    from texify.settings import settings
+
+    if hasattr(image, "shape"):
+        height, width = image.shape[:2]
+    else:
+        width, height = image.size
+    lines = max(1, -(-height // LINE_HEIGHT))
+    budget = lines * width // PIXELS_PER_TOKEN
+    return max(MIN_NEW_TOKENS, min(settings.MAX_TOKENS, budget))
+
+
+def run_inference(images):
+    """对一组图片运行推理，返回与输入一一对应的 LaTeX 文本列表"""
+    # 按原始宽度估算，须在缩放前计算
+    budgets = [token_budget(image) for image in images]
+    max_height, max_width = _input_size(get_processor())
+    images = [downscale_image(image, max_height, max_width) for image in images]
+
+    sessions = get_onnx_sessions()
+    if sessions is not None:
+        # 处理器可直接接收 numpy 数组，无需再经过 PIL
+        return onnx_inference(images, sessions, get_processor(), budgets)
+
+    from PIL import Image
+    from texify.inference import batch_inference
+
+    # batch_inference 内部会统一 convert("RGB")，这里不再重复转换
+    images = [image if isinstance(image, Image.Image) else Image.fromarray(image) for image in images]
+    model, processor = get_model_and_processor()
+    results = []
+    with _inference_context():
+        for start in range(0, len(images), MAX_BATCH_SIZE):
+            end = start + MAX_BATCH_SIZE
+            try:
+                batch = batch_inference(
+                    images[start:end], model, processor,
+                    max_tokens=max(budgets[start:end]),
+                )
+            except Exception:
+                # 编译后的解码器遇到预热未覆盖的输入时可能出错：换回 eager 重试，此后不再使用编译版本
+                if not _use_eager_decoder(model):
+                    raise
+                batch = batch_inference(
+                    images[start:end], model, processor,
+                    max_tokens=max(budgets[start:end]),
+                )
+            results.extend(batch)
+    return results
+
+
+def recognize_batch(image_paths):
+    """批量识别多张图片，返回与输入顺序一致的结果字典列表
+
+    单张图片读取失败只影响该图片；推理失败时整批返回同一错误。
+    """
+    responses = [None] * len(image_paths)
+    images, indices = [], []
+    for i, image_path in enumerate(image_paths):
+        if not os.path.exists(image_path):
+            responses[i] = {"error": f"图片文件不存在: {image_path}"}
+            continue
+        try:
+            images.append(load_image(image_path))
+            indices.append(i)
+        except Exception as e:
+            responses[i] = error_response(e)
+
+    if images:
+        try:
+            results = run_inference(images)
+        except Exception as e:
+            results = []
+            for i in indices:
+                responses[i] = error_response(e)
+
+        for i, result in zip(indices, results):
+            responses[i] = {"latex": strip_math_delimiters(_result_text(result)), "confidence": 0.95}
+
+    return [response or {"error": "识别结果为空"} for response in responses]
+
+
+def recognize(image_path):
+    """识别单张图片，返回结果字典（成功含 latex/confidence，失败含 error）"""
+    return recognize_batch([image_path])[0]
+
+
+def handle_request(line):
+    """处理一行常驻模式请求
+
+    - 纯文本行视为单个图片路径，返回单个结果
+    - JSON 行 `{"paths": [...]}` 为批量请求，返回 `{"results": [...]}`
+    """
+    if line.startswith("{"):
+        try:
+            request = json.loads(line)
+            paths = request["paths"]
+        except (ValueError, KeyError, TypeError) as e:
+            return {"error": f"无效的请求: {e}"}
+        if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+            return {"error": "无效的请求: paths 必须是字符串列表"}
+        return {"results": recognize_batch(paths)}
+    return recognize(line)
+
+
+def serve():
+    """常驻模式：预先加载模型，然后逐行处理 stdin 中的请求"""
+    try:
+        if get_onnx_sessions() is not None:
+            get_processor()
         else:
-            output_json({"error": "识别结果为空"})
-            sys.exit(1)
-            
+            import torch
+
+            model, processor = get_model_and_processor()
+            # 预热和编译耗时较长，只在常驻模式下做（且仅限 GPU），由后续所有请求分摊；
+            # 单次模式下预热只会在真正识别前多跑一次 generate()
+            if torch.cuda.is_available():
+                _warmup(model, processor)
+                compile_decoder(model, processor)
     except Exception as e:
-        output_json({"error": str(e)})
+        output_json(error_response(e, "模型加载失败: "))
         sys.exit(1)
 
+    # Rust 端以 UTF-8 写入路径；管道默认使用系统区域编码（中文 Windows 为 GBK），
+    # 用户名含非 ASCII 字符时临时目录路径会被解码错
+    sys.stdin.reconfigure(encoding="utf-8", errors="replace")
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        # 单个请求出错不能让常驻进程退出
+        try:
+            response = handle_request(line)
+        except Exception as e:
+            response = error_response(e)
+        output_json(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="ocr_engine", add_help=False)
+    parser.add_argument("--serve", action="store_true")
+    parser.add_argument("--debug", action="store_true")
+    parser.add_argument("image_path", nargs="?")
+    args, _ = parser.parse_known_args()
+
+    global DEBUG
+    DEBUG = DEBUG or args.debug
+
+    if args.serve:
+        serve()
+        return
+
+    if not args.image_path:
+        output_json({"error": "用法: ocr_engine <image_path> | ocr_engine --serve"})
+        sys.exit(1)
+
+    result = recognize(args.image_path)
+    output_json(result)
+    if "error" in result:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
+    # 打包后的 exe 中 multiprocessing 子进程会重新执行本程序，需先交给 freeze_support 处理
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,96 @@
+"""
+OCR 权重常驻预热进程
+
+加载一次 texify 模型，把全部权重复制到一块命名共享内存中，并写出布局文件
+（参数名 -> offset/dtype/shape）。之后启动的 ocr_server.py 会直接从共享内存
+构建模型，跳过磁盘读取和 safetensors 解析。
+
+进程需保持运行（Windows 上共享内存随最后一个句柄关闭而释放），
+stdin 关闭或收到 Ctrl+C 时清理共享内存并退出。
+
+仅用于开发时反复以单次模式运行 ocr_server.py：应用不会启动本脚本，也不会打包它，
+常驻模式（--serve）本身已让模型只加载一次并保持在内存中。
+"""
+import os
+import sys
+import json
+
+from ocr_server import SHM_LAYOUT_PATH, get_model_and_processor
+
+SHM_NAME = "formulasnap_texify_weights"
+
+# 每个张量按 64 字节对齐，保证 SIMD 读取对齐
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def publish_weights():
+    """把模型权重复制进共享内存，返回 SharedMemory 对象"""
+    import torch
+    from multiprocessing import shared_memory
+    from texify.settings import settings
+
+    # 从磁盘加载，不附加到可能残留的旧内存块
+    if os.path.exists(SHM_LAYOUT_PATH):
+        os.remove(SHM_LAYOUT_PATH)
+    model, _ = get_model_and_processor()
+    state_dict = model.state_dict()
+
+    tensors = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        offset = _align(offset)
+        tensors[name] = {
+            "offset": offset,
+            "dtype": str(tensor.dtype).replace("torch.", ""),
+            "shape": list(tensor.shape),
+            "numel": tensor.numel(),
+        }
+        offset += tensor.numel() * tensor.element_size()
+
+    try:
+        # 上次异常退出可能残留同名内存块
+        stale = shared_memory.SharedMemory(name=SHM_NAME)
+        stale.close()
+        stale.unlink()
+    except FileNotFoundError:
+        pass
+
+    shm = shared_memory.SharedMemory(name=SHM_NAME, create=True, size=max(offset, 1))
+    for name, tensor in state_dict.items():
+        entry = tensors[name]
+        target = torch.frombuffer(shm.buf, dtype=tensor.dtype, count=entry["numel"], offset=entry["offset"])
+        target.copy_(tensor.detach().reshape(-1))
+
+    # 先写临时文件再替换，避免 ocr_server 读到半个布局文件
+    layout = {"name": SHM_NAME, "checkpoint": settings.MODEL_CHECKPOINT, "tensors": tensors}
+    tmp_path = SHM_LAYOUT_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(layout, f)
+    os.replace(tmp_path, SHM_LAYOUT_PATH)
+
+    print(f"权重已写入共享内存 {SHM_NAME}: {offset / 1024 / 1024:.1f} MB", file=sys.stderr)
+    return shm
+
+
+def main():
+    shm = publish_weights()
+    try:
+        # 阻塞直到父进程关闭 stdin
+        sys.stdin.read()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        try:
+            os.remove(SHM_LAYOUT_PATH)
+        except OSError:
+            pass
+        shm.close()
+        shm.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+对导出的 texify ONNX 编码器做 INT8 量化（默认动态量化）。
+
+只量化 MatMul，权重使用 QInt8 + per-channel；QUInt8 per-tensor 会明显损失精度和速度。
+解码器保持 FP32：自回归解码每步的 MatMul 很小，量化开销反而占主导。
+需先运行 `python scripts/export_onnx.py --texify`。
+
+使用 `--static` 时改为 QDQ 静态量化：用一组公式截图校准激活值范围，
+省去推理时的动态 scale 计算，并让 ORT 融合出 QLinearMatMul。
+"""
+import os
+import sys
+import argparse
+
+TEXIFY_MODEL_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "models", "texify")
+)
+CALIBRATION_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), "..", "models", "calibration")
+)
+# 校准使用的最大样本数
+CALIBRATION_SAMPLES = 200
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".bmp")
+
+
+def _require_encoder(model_dir):
+    input_path = os.path.join(model_dir, "encoder.onnx")
+    if not os.path.exists(input_path):
+        print(f"找不到编码器模型: {input_path}")
+        print("请先运行: python scripts/export_onnx.py --texify")
+        sys.exit(1)
+    return input_path
+
+
+def quantize_encoder_dynamic(model_dir=TEXIFY_MODEL_DIR):
+    """encoder.onnx -> encoder.int8.onnx"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    input_path = _require_encoder(model_dir)
+    output_path = os.path.join(model_dir, "encoder.int8.onnx")
+
+    print(f"正在量化编码器: {input_path}")
+    quantize_dynamic(
+        input_path,
+        output_path,
+        op_types_to_quantize=["MatMul"],
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        reduce_range=False,
+    )
+    print(
+        f"量化完成: {output_path} "
+        f"({os.path.getsize(input_path) / 1024 / 1024:.1f} MB -> "
+        f"{os.path.getsize(output_path) / 1024 / 1024:.1f} MB)"
+    )
+
+
+def _calibration_reader(image_dir, limit=CALIBRATION_SAMPLES):
+    """构造 CalibrationDataReader：逐张产出与推理时相同预处理的 pixel_values"""
+    from onnxruntime.quantization import CalibrationDataReader
+    from PIL import Image
+    from texify.model.processor import load_processor
+
+    class FormulaCalibrationReader(CalibrationDataReader):
+        def __init__(self, paths):
+            self.paths = iter(paths)
+            self.processor = load_processor()
+
+        def get_next(self):
+            path = next(self.paths, None)
+            if path is None:
+                return None
+            image = Image.open(path).convert("RGB")
+            pixel_values = self.processor(images=[image], return_tensors="np")["pixel_values"]
+            return {"pixel_values": pixel_values.astype("float32")}
+
+    paths = sorted(
+        os.path.join(image_dir, name)
+        for name in os.listdir(image_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+    if not paths:
+        print(f"校准目录中没有图片: {image_dir}")
+        sys.exit(1)
+    print(f"使用 {len(paths)} 张公式截图进行校准")
+    return FormulaCalibrationReader(paths)
+
+
+def quantize_encoder_static(model_dir=TEXIFY_MODEL_DIR, calibration_dir=CALIBRATION_DIR):
+    """encoder.onnx -> encoder.int8_static.onnx（QDQ 格式，Percentile 校准）"""
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    input_path = _require_encoder(model_dir)
+    preprocessed_path = os.path.join(model_dir, "encoder.preprocessed.onnx")
+    output_path = os.path.join(model_dir, "encoder.int8_static.onnx")
+
+    if not os.path.isdir(calibration_dir):
+        print(f"找不到校准图片目录: {calibration_dir}")
+        sys.exit(1)
+
+    # 符号形状推断 + 图优化，便于量化后的节点融合
+    print("正在进行量化预处理（符号形状推断 + 图优化）...")
+    quant_pre_process(input_path, preprocessed_path)
+
+    print(f"正在静态量化编码器: {preprocessed_path}")
+    quantize_static(
+        preprocessed_path,
+        output_path,
+        _calibration_reader(calibration_dir),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.Percentile,
+    )
+    os.remove(preprocessed_path)
+    print(
+        f"量化完成: {output_path} "
+        f"({os.path.getsize(input_path) / 1024 / 1024:.1f} MB -> "
+        f"{os.path.getsize(output_path) / 1024 / 1024:.1f} MB)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="texify ONNX 编码器 INT8 量化")
+    parser.add_argument("--static", action="store_true", help="使用校准数据做静态量化")
+    parser.add_argument("--calibration-dir", default=CALIBRATION_DIR, help="校准用公式截图目录")
+    args = parser.parse_args()
+
+    if args.static:
+        quantize_encoder_static(calibration_dir=args.calibration_dir)
+    else:
+        quantize_encoder_dynamic()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,58 @@
-"""测试 OMML 转换"""
+"""测试 OMML 转换
+
+用法:
+    python test_omml.py           打印示例公式的 MathML 和预期 OMML 结构
+    python test_omml.py --serve   常驻模式：从 stdin 逐行读取 LaTeX，每行输出一行 MathML
+"""
 import subprocess
 import sys
 
-# 简单的 LaTeX
-latex = r"e_{v}^{(1)}"
-
-# 调用 Rust 程序测试
-# 这里我们直接用 Python 的 latex2mathml 来看 MathML
+# 模块级导入一次，常驻模式下所有公式共用
 import latex2mathml.converter
-mathml = latex2mathml.converter.convert(latex)
-print("MathML:")
-print(mathml)
-print()
 
-# 手动构造预期的 OMML
-expected_omml = '''<m:sSubSup>
+
+def serve():
+    """逐行转换 stdin 中的 LaTeX，避免每个公式都重新启动 Python"""
+    # 管道默认使用系统区域编码（中文 Windows 为 GBK），与 Rust 端的 UTF-8 不一致；
+    # MathML 中的 Unicode 符号在 GBK 下还会写出失败，导致常驻循环退出
+    sys.stdin.reconfigure(encoding="utf-8", errors="replace")
+    sys.stdout.reconfigure(encoding="utf-8")
+    for line in sys.stdin:
+        latex = line.strip()
+        if not latex:
+            continue
+        try:
+            mathml = latex2mathml.converter.convert(latex)
+        except Exception as e:
+            mathml = f"ERROR: {e}"
+        sys.stdout.write(mathml.replace("\n", "") + "\n")
+        sys.stdout.flush()
+
+
+def main():
+    # 简单的 LaTeX
+    latex = r"e_{v}^{(1)}"
+
+    # 调用 Rust 程序测试
+    # 这里我们直接用 Python 的 latex2mathml 来看 MathML
+    mathml = latex2mathml.converter.convert(latex)
+    print("MathML:")
+    print(mathml)
+    print()
+
+    # 手动构造预期的 OMML
+    expected_omml = '''<m:sSubSup>
   <m:sSubSupPr/>
   <m:e><m:r><m:t>e</m:t></m:r></m:e>
   <m:sub><m:r><m:t>v</m:t></m:r></m:sub>
   <m:sup><m:r><m:t>(1)</m:t></m:r></m:sup>
 </m:sSubSup>'''
-print("Expected OMML structure:")
-print(expected_omml)
+    print("Expected OMML structure:")
+    print(expected_omml)
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve()
+    else:
+        main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 被测脚本位于 scripts/，不是可安装的包
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
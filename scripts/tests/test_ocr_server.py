@@ -0,0 +1,203 @@
+"""ocr_server.py 单元测试（python -m pytest scripts/tests）"""
+import types
+
+import pytest
+
+import ocr_server
+
+
+def _tiny_mbart_decoder():
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from transformers import MBartConfig
+    from transformers.models.mbart.modeling_mbart import MBartForCausalLM
+
+    torch.manual_seed(0)
+    config = MBartConfig(
+        vocab_size=64,
+        d_model=32,
+        decoder_layers=2,
+        decoder_attention_heads=4,
+        decoder_ffn_dim=64,
+        max_position_embeddings=64,
+        is_decoder=True,
+        add_cross_attention=True,
+        scale_embedding=True,
+    )
+    decoder = MBartForCausalLM(config).eval()
+    with torch.no_grad():
+        # 默认初始化下 logits 过于平坦，贪心解码几乎总是同一个 token
+        for name, param in decoder.named_parameters():
+            if "norm" not in name:
+                param.normal_(0, 0.3)
+    return decoder
+
+
+def _greedy_decode(decoder, encoder_hidden_states, steps):
+    """逐 token 贪心解码，返回生成的 token 与每步 logits"""
+    import torch
+
+    batch = encoder_hidden_states.shape[0]
+    input_ids = torch.zeros((batch, 1), dtype=torch.long)
+    past_key_values = None
+    tokens, logits = [], []
+    with torch.inference_mode():
+        for _ in range(steps):
+            out = decoder(
+                input_ids=input_ids,
+                encoder_hidden_states=encoder_hidden_states,
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+            past_key_values = out.past_key_values
+            logits.append(out.logits[:, -1])
+            input_ids = out.logits[:, -1].argmax(-1, keepdim=True)
+            tokens.append(input_ids)
+    return torch.cat(tokens, dim=1), torch.stack(logits, dim=1)
+
+
+@pytest.mark.parametrize("max_len", [32, 4])
+def test_preallocated_kv_cache_matches_eager(max_len):
+    """预分配 KV 缓存与原 MBart 实现逐步一致；max_len 过小时退回 torch.cat"""
+    import torch
+
+    decoder = _tiny_mbart_decoder()
+    model = types.SimpleNamespace(decoder=decoder)
+    encoder_hidden_states = torch.randn(2, 7, 32)
+
+    expected_tokens, expected_logits = _greedy_decode(decoder, encoder_hidden_states, steps=12)
+    ocr_server._preallocate_kv_cache(model, max_len)
+    tokens, logits = _greedy_decode(decoder, encoder_hidden_states, steps=12)
+
+    patched = [m for m in decoder.modules() if "_original_forward" in m.__dict__]
+    assert len(patched) == decoder.config.decoder_layers
+    assert all("_kv_buffer" in m.__dict__ for m in patched)
+    assert torch.equal(tokens, expected_tokens)
+    torch.testing.assert_close(logits, expected_logits, rtol=1e-5, atol=1e-5)
+
+
+def test_restore_self_attention_removes_patch():
+    import torch
+
+    decoder = _tiny_mbart_decoder()
+    model = types.SimpleNamespace(decoder=decoder)
+    encoder_hidden_states = torch.randn(1, 5, 32)
+    expected_tokens, _ = _greedy_decode(decoder, encoder_hidden_states, steps=6)
+
+    ocr_server._preallocate_kv_cache(model, 16)
+    _greedy_decode(decoder, encoder_hidden_states, steps=6)
+    ocr_server._restore_self_attention(model)
+
+    for module in decoder.modules():
+        assert "forward" not in module.__dict__
+        assert "_kv_buffer" not in module.__dict__
+    tokens, _ = _greedy_decode(decoder, encoder_hidden_states, steps=6)
+    assert torch.equal(tokens, expected_tokens)
+
+
+@pytest.mark.parametrize("line", [
+    '{"paths": "a.png"}',
+    '{"paths": [1, 2]}',
+    '{"paths": ["a.png", null]}',
+    '{"path": ["a.png"]}',
+    '{"paths": ',
+    '{}',
+])
+def test_handle_request_rejects_malformed_batch(line, monkeypatch):
+    def fail(paths):
+        raise AssertionError("无效请求不应进入识别")
+
+    monkeypatch.setattr(ocr_server, "recognize_batch", fail)
+    response = ocr_server.handle_request(line)
+    assert response["error"].startswith("无效的请求")
+
+
+def test_handle_request_dispatches_single_and_batch(monkeypatch):
+    monkeypatch.setattr(ocr_server, "recognize_batch", lambda paths: [{"latex": p} for p in paths])
+
+    assert ocr_server.handle_request('{"paths": ["a.png", "b.png"]}') == {
+        "results": [{"latex": "a.png"}, {"latex": "b.png"}]
+    }
+    assert ocr_server.handle_request("C:/截图/a.png") == {"latex": "C:/截图/a.png"}
+
+
+def test_serve_keeps_running_after_failed_request(monkeypatch):
+    import io
+    import json
+
+    def handle(line):
+        if line == "boom":
+            raise RuntimeError("识别失败")
+        return {"latex": line}
+
+    stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    monkeypatch.setattr(ocr_server, "DEBUG", False)
+    monkeypatch.setattr(ocr_server, "get_onnx_sessions", lambda: {})
+    monkeypatch.setattr(ocr_server, "get_processor", lambda: None)
+    monkeypatch.setattr(ocr_server, "handle_request", handle)
+    monkeypatch.setattr(ocr_server, "_original_stdout", stdout)
+    monkeypatch.setattr("sys.stdin", io.TextIOWrapper(io.BytesIO("boom\nx^2\n".encode("utf-8"))))
+
+    ocr_server.serve()
+
+    lines = stdout.buffer.getvalue().decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [{"error": "识别失败"}, {"latex": "x^2"}]
+
+
+def test_token_budget_scales_with_line_count():
+    """多行公式（aligned、矩阵）宽度不大但 token 多，预算须随高度增长"""
+    pytest.importorskip("texify")
+    from PIL import Image
+
+    single_line = ocr_server.token_budget(Image.new("RGB", (800, 32)))
+    three_lines = ocr_server.token_budget(Image.new("RGB", (800, 96)))
+    assert single_line == 200
+    assert three_lines > single_line
+
+
+def test_token_budget_is_clamped():
+    np = pytest.importorskip("numpy")
+    pytest.importorskip("texify")
+    from texify.settings import settings
+
+    # 窄小截图也保留足够余量
+    assert ocr_server.token_budget(np.zeros((30, 100, 3), dtype=np.uint8)) == ocr_server.MIN_NEW_TOKENS
+    assert ocr_server.token_budget(np.zeros((2000, 2000, 3), dtype=np.uint8)) == settings.MAX_TOKENS
+    # numpy 数组按 (height, width) 读取尺寸：3 行 x 400 像素宽
+    assert ocr_server.token_budget(np.zeros((96, 400, 3), dtype=np.uint8)) == 300
+
+
+@pytest.mark.parametrize("text", [
+    "a , b . c ? d !",
+    "it 's , we 're , I 'm , they 've , do n't",
+    "x ' y",
+    r"\frac { 1 } { 2 } , x ^ { 2 } .",
+])
+def test_clean_up_tokenization_matches_transformers(text):
+    pytest.importorskip("transformers")
+    from transformers import PreTrainedTokenizerBase
+
+    expected = PreTrainedTokenizerBase.clean_up_tokenization(text)
+    assert ocr_server.FastTokenizer.clean_up_tokenization(text) == expected
+
+
+@pytest.mark.parametrize("clean_up", [True, False])
+def test_fast_tokenizer_applies_clean_up_flag(clean_up, tmp_path):
+    tokenizers = pytest.importorskip("tokenizers")
+
+    vocab = {"<s>": 0, "<pad>": 1, "</s>": 2, "x": 3, ",": 4, "y": 5, ".": 6}
+    tokenizer = tokenizers.Tokenizer(tokenizers.models.WordLevel(vocab, unk_token="<pad>"))
+    tokenizer.add_special_tokens(["<s>", "<pad>", "</s>"])
+    tokenizer_path = tmp_path / "tokenizer.json"
+    tokenizer.save(str(tokenizer_path))
+
+    fast = ocr_server.FastTokenizer(str(tokenizer_path), {
+        "bos_token_id": 0,
+        "eos_token_id": 2,
+        "pad_token_id": 1,
+        "clean_up_tokenization_spaces": clean_up,
+    })
+    ids = [0, 3, 4, 5, 6, 2]
+    expected = "x, y." if clean_up else "x , y ."
+    assert fast.decode(ids, skip_special_tokens=True) == expected
+    assert fast.batch_decode([ids, ids], skip_special_tokens=True) == [expected, expected]
@@ -39,13 +39,114 @@ async fn cancel_capture() -> Result<(), String> {
     Err("用户取消截图".to_string())
 }
 
+/// 常驻 OCR 引擎进程
+///
+/// 以 `--serve` 模式启动 ocr_engine，模型只在启动时加载一次；
+/// 之后每次识别通过 stdin 写入一行图片路径，从 stdout 读取一行 JSON 结果。
+struct OcrServer {
+    child: std::process::Child,
+    stdin: std::process::ChildStdin,
+    stdout: std::io::BufReader<std::process::ChildStdout>,
+}
+
+impl OcrServer {
+    /// 启动 OCR 引擎进程（Windows 上隐藏控制台窗口）
+    fn spawn(app_handle: &tauri::AppHandle) -> Result<Self, String> {
+        use std::process::{Command, Stdio};
+
+        let (ocr_cmd, mut ocr_args) = get_ocr_command(app_handle)?;
+        ocr_args.push("--serve".to_string());
+
+        let mut command = Command::new(&ocr_cmd);
+        command
+            .args(&ocr_args)
+            .stdin(Stdio::piped())
+            .stdout(Stdio::piped())
+            .stderr(Stdio::null());
+
+        #[cfg(windows)]
+        {
+            use std::os::windows::process::CommandExt;
+            const CREATE_NO_WINDOW: u32 = 0x08000000;
+            command.creation_flags(CREATE_NO_WINDOW);
+        }
+
+        let mut child = command
+            .spawn()
+            .map_err(|e| format!("无法启动 OCR 引擎: {}", e))?;
+
+        let stdin = child.stdin.take().ok_or("无法连接 OCR 引擎输入流")?;
+        let stdout = child.stdout.take().ok_or("无法连接 OCR 引擎输出流")?;
+
+        Ok(Self {
+            child,
+            stdin,
+            stdout: std::io::BufReader::new(stdout),
+        })
+    }
+
+    /// 发送一个图片路径并读取一行 JSON 响应
+    fn request(&mut self, image_path: &std::path::Path) -> Result<String, String> {
+        use std::io::{BufRead, Write};
+
+        writeln!(self.stdin, "{}", image_path.to_string_lossy())
+            .and_then(|_| self.stdin.flush())
+            .map_err(|e| format!("无法向 OCR 引擎发送请求: {}", e))?;
+
+        let mut line = String::new();
+        let n = self
+            .stdout
+            .read_line(&mut line)
+            .map_err(|e| format!("读取 OCR 结果失败: {}", e))?;
+        if n == 0 {
+            return Err("OCR 引擎已退出".to_string());
+        }
+        Ok(line)
+    }
+}
+
+impl Drop for OcrServer {
+    fn drop(&mut self) {
+        let _ = self.child.kill();
+        let _ = self.child.wait();
+    }
+}
+
+/// 全局常驻 OCR 引擎进程，首次识别时启动
+static OCR_SERVER: std::sync::Mutex<Option<OcrServer>> = std::sync::Mutex::new(None);
+
+/// 通过常驻 OCR 引擎识别一张图片，返回原始 JSON 行
+///
+/// 进程不存在时启动；若进程已退出或通信失败，重启一次后重试。
+fn request_ocr(app_handle: &tauri::AppHandle, image_path: &std::path::Path) -> Result<String, String> {
+    let mut guard = OCR_SERVER
+        .lock()
+        .map_err(|e| format!("OCR 引擎锁被污染: {}", e))?;
+
+    if let Some(server) = guard.as_mut() {
+        match server.request(image_path) {
+            Ok(line) => return Ok(line),
+            Err(e) => {
+                eprintln!("[recognize_formula] OCR 引擎通信失败，正在重启: {}", e);
+                *guard = None;
+            }
+        }
+    }
+
+    let result = guard.insert(OcrServer::spawn(app_handle)?).request(image_path);
+    if result.is_err() {
+        *guard = None;
+    }
+    result
+}
+
 /// 使用 texify 进行公式识别
 /// 
 /// 优先使用打包的 ocr_engine.exe（PyInstaller 打包），
-/// 回退到 Python 脚本调用。
+/// 回退到 Python 脚本调用。OCR 引擎以常驻进程运行，
+/// 模型只在首次识别时加载一次。
 #[tauri::command]
 async fn recognize_formula(image: Vec<u8>, app_handle: tauri::AppHandle) -> Result<OcrResult, String> {
-    use std::process::Command;
     use std::io::Write;
 
     // 将图片写入临时文件
@@ -59,38 +160,14 @@ async fn recognize_formula(image: Vec<u8>, app_handle: tauri::AppHandle) -> Resu
             .map_err(|e| format!("无法写入临时文件: {}", e))?;
     }
 
-    // 获取 OCR 引擎路径
-    let (ocr_cmd, ocr_args) = get_ocr_command(&app_handle, &temp_path)?;
-
-    // 调用 OCR 引擎（Windows 上隐藏控制台窗口）
-    #[cfg(windows)]
-    let output = {
-        use std::os::windows::process::CommandExt;
-        const CREATE_NO_WINDOW: u32 = 0x08000000;
-        Command::new(&ocr_cmd)
-            .args(&ocr_args)
-            .creation_flags(CREATE_NO_WINDOW)
-            .output()
-            .map_err(|e| format!("无法启动 OCR 引擎: {}", e))?
-    };
-    
-    #[cfg(not(windows))]
-    let output = Command::new(&ocr_cmd)
-        .args(&ocr_args)
-        .output()
-        .map_err(|e| format!("无法启动 OCR 引擎: {}", e))?;
+    let output = request_ocr(&app_handle, &temp_path);
 
     // 清理临时文件
     let _ = std::fs::remove_file(&temp_path);
 
-    if !output.status.success() {
-        let stderr = String::from_utf8_lossy(&output.stderr);
-        return Err(format!("OCR 识别失败: {}", stderr));
-    }
-
     // 解析 JSON 输出
-    let stdout = String::from_utf8_lossy(&output.stdout);
-    let result: serde_json::Value = serde_json::from_str(&stdout)
+    let stdout = output.map_err(|e| format!("OCR 识别失败: {}", e))?;
+    let result: serde_json::Value = serde_json::from_str(stdout.trim())
         .map_err(|e| format!("解析 OCR 结果失败: {}。输出: {}", e, stdout))?;
 
     if let Some(error) = result.get("error") {
@@ -111,24 +188,32 @@ async fn recognize_formula(image: Vec<u8>, app_handle: tauri::AppHandle) -> Resu
 
 /// 获取 OCR 命令和参数
 /// 优先使用打包的 ocr_engine.exe，回退到 Python 脚本
-fn get_ocr_command(app_handle: &tauri::AppHandle, image_path: &std::path::Path) -> Result<(String, Vec<String>), String> {
+fn get_ocr_command(app_handle: &tauri::AppHandle) -> Result<(String, Vec<String>), String> {
     use tauri::Manager;
     
-    let image_arg = image_path.to_string_lossy().to_string();
     let mut searched_paths: Vec<String> = Vec::new();
     
     // 1. 首先尝试打包的 ocr_engine.exe（生产环境）
     if let Ok(resource_path) = app_handle.path().resource_dir() {
-        // --onefile 模式: ocr_engine/ocr_engine.exe
-        let exe_path = resource_path.join("ocr_engine").join("ocr_engine.exe");
-        searched_paths.push(exe_path.to_string_lossy().to_string());
-        if exe_path.exists() {
-            return Ok((exe_path.to_string_lossy().to_string(), vec![image_arg]));
+        let engine_dir = resource_path.join("ocr_engine");
+        // --onedir 模式（build_ocr.py）: ocr_engine/ocr_engine/ocr_engine.exe
+        // --onefile 模式（旧版构建）: ocr_engine/ocr_engine.exe
+        let exe_paths = [
+            engine_dir.join("ocr_engine").join("ocr_engine.exe"),
+            engine_dir.join("ocr_engine.exe"),
+        ];
+        for exe_path in &exe_paths {
+            searched_paths.push(exe_path.to_string_lossy().to_string());
+            if exe_path.exists() {
+                return Ok((exe_path.to_string_lossy().to_string(), Vec::new()));
+            }
         }
     }
     
     // 2. 开发模式：尝试本地打包的 ocr_engine
     let dev_exe_paths = [
+        "ocr_engine/ocr_engine/ocr_engine.exe",
+        "../src-tauri/ocr_engine/ocr_engine/ocr_engine.exe",
         "ocr_engine/ocr_engine.exe",
         "../src-tauri/ocr_engine/ocr_engine.exe",
     ];
@@ -136,7 +221,7 @@ fn get_ocr_command(app_handle: &tauri::AppHandle, image_path: &std::path::Path)
     for path in &dev_exe_paths {
         searched_paths.push(path.to_string());
         if std::path::Path::new(path).exists() {
-            return Ok((path.to_string(), vec![image_arg]));
+            return Ok((path.to_string(), Vec::new()));
         }
     }
     
@@ -155,7 +240,7 @@ fn get_ocr_command(app_handle: &tauri::AppHandle, image_path: &std::path::Path)
                 .canonicalize()
                 .map(|p| p.to_string_lossy().to_string())
                 .unwrap_or_else(|_| path.to_string());
-            return Ok((python, vec![script, image_arg]));
+            return Ok((python, vec![script]));
         }
     }
 